@@ -0,0 +1,162 @@
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Subset
+from tokenizer import Tokenizer
+from model import GPTModel
+from qa_dataset import QADataset
+from inferance import greedy_generate_batch
+from tqdm import tqdm
+import queue, time, sys, traceback
+
+"""
+验证代码：验证集 loss、贪心生成的完全匹配率，以及在独立进程中异步验证的 AsyncValidator
+"""
+def validate_model(model, criterion, device, val_loader, show_progress=True):
+    # loss 累加在设备上，最后只同步一次，避免每个 batch 调用 loss.item()
+    running_loss = torch.zeros((), device=device)
+    with torch.no_grad():
+        for _, data in enumerate(tqdm(val_loader, file=sys.stdout, desc="Validation Data", disable=not show_progress)):
+            input_ids = data['input_ids'].to(device, dtype=torch.long)
+            attention_mask = data['attention_mask'].to(device, dtype=torch.long)
+            labels = data['labels'].to(device, dtype=torch.long)
+            outputs, dec_self_attns = model(input_ids, attention_mask)
+            loss = criterion(outputs, labels.view(-1))
+            running_loss += loss.detach()
+    return running_loss.item() / len(val_loader)
+
+
+def sample_indices(size, num, seed=0):
+    # 固定随机种子，保证每个 epoch 验证的是同一批数据，loss 之间可比
+    if num >= size:
+        return list(range(size))
+    generator = torch.Generator().manual_seed(seed)
+    return sorted(torch.randperm(size, generator=generator)[:num].tolist())
+
+
+def build_val_loader(val_set, batch_size, subsample=1.0, num_workers=0, seed=0):
+    if subsample < 1.0:
+        val_set = Subset(val_set, sample_indices(len(val_set), max(1, int(len(val_set) * subsample)), seed))
+    return DataLoader(val_set, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+
+def exact_match(model, tokenizer, samples, max_length, device, batch_size):
+    ##
+    # samples: [{"question": ..., "answer": ...}]
+    ##
+    # 按问题长度分桶，同一个桶内的问题长度相同，不需要 pad 就能批量生成
+    buckets = {}
+    for sample in samples:
+        input, _ = tokenizer.encode(sample["question"])
+        target, _ = tokenizer.encode(sample["answer"])
+        buckets.setdefault(len(input), []).append((input, target))
+    correct = 0
+    with torch.no_grad():
+        for items in buckets.values():
+            for i in range(0, len(items), batch_size):
+                batch = items[i:i + batch_size]
+                input = torch.tensor([item[0] for item in batch], dtype=torch.long, device=device)
+                generated = greedy_generate_batch(model, input, max_length, tokenizer.sep_token, tokenizer.pad_token)
+                for tokens, (_, target) in zip(generated.tolist(), batch):
+                    if tokens[:len(target)] == target:
+                        correct += 1
+    return correct / len(samples)
+
+
+def _eval_worker(job_queue, result_queue, eval_param):
+    device = eval_param["device"]
+    try:
+        tokenizer = Tokenizer(eval_param["vocab_path"])
+        model = GPTModel(**dict(eval_param["model_param"], device=device)).to(device)
+        model.eval()
+        val_set = QADataset(eval_param["val_json_path"], tokenizer, eval_param["max_length"])
+        val_loader = build_val_loader(val_set, eval_param["batch_size"], eval_param["subsample"])
+        gen_samples = [val_set.data[i] for i in sample_indices(len(val_set), eval_param["gen_samples"])]
+        criterion = torch.nn.CrossEntropyLoss(ignore_index=0).to(device)
+    except Exception:
+        # 启动失败也要通知训练进程，epoch 为 None
+        result_queue.put({"epoch": None, "error": traceback.format_exc()})
+        return
+    while True:
+        job = job_queue.get()
+        # 收到 None 表示训练结束
+        if job is None:
+            break
+        epoch, state_dict = job
+        try:
+            time1 = time.time()
+            model.load_state_dict(state_dict)
+            val_loss = validate_model(model, criterion, device, val_loader, show_progress=False)
+            em = None
+            if gen_samples:
+                em = exact_match(model, tokenizer, gen_samples, eval_param["gen_max_length"], device,
+                                 eval_param["batch_size"])
+            result_queue.put({"epoch": epoch, "val_loss": val_loss, "exact_match": em,
+                              "eval_time": time.time() - time1})
+        except Exception:
+            result_queue.put({"epoch": epoch, "error": traceback.format_exc()})
+
+
+class AsyncValidator():
+    """
+    在独立进程中验证：训练进程把每个 epoch 的权重放入队列后继续训练，验证结果通过 poll/close 取回
+    """
+    def __init__(self, eval_param, max_pending=2):
+        # CUDA 只能在 spawn 出来的子进程中使用
+        ctx = mp.get_context("spawn")
+        # 队列满时 submit 会阻塞，限制同时驻留的权重副本数量
+        self.job_queue = ctx.Queue(maxsize=max_pending)
+        self.result_queue = ctx.Queue()
+        self.process = ctx.Process(target=_eval_worker, args=(self.job_queue, self.result_queue, eval_param),
+                                   daemon=True)
+        self.process.start()
+        self.pending = 0
+
+    def submit(self, epoch, state_dict):
+        # 队列满时等待，同时检查验证进程是否还活着，避免永远阻塞
+        while True:
+            try:
+                self.job_queue.put((epoch, state_dict), timeout=1)
+                break
+            except queue.Full:
+                self._check_alive()
+        self.pending += 1
+
+    def poll(self, block=False):
+        results = []
+        while self.pending > 0:
+            try:
+                result = self.result_queue.get(block=block, timeout=1 if block else None)
+            except queue.Empty:
+                self._check_alive()
+                if not block:
+                    break
+                continue
+            if "error" in result:
+                self._raise_error(result)
+            self.pending -= 1
+            results.append(result)
+        return results
+
+    def _check_alive(self):
+        if self.process.is_alive():
+            return
+        # 进程已经退出，先取出它留下的错误信息
+        try:
+            result = self.result_queue.get(timeout=1)
+        except queue.Empty:
+            raise RuntimeError("验证进程意外退出！")
+        if "error" in result:
+            self._raise_error(result)
+        raise RuntimeError("验证进程意外退出！")
+
+    def _raise_error(self, result):
+        if result["epoch"] is None:
+            raise RuntimeError(f"验证进程启动失败：\n{result['error']}")
+        raise RuntimeError(f"epoch {result['epoch']} 验证失败：\n{result['error']}")
+
+    def close(self):
+        # 等待剩余的验证结果，然后结束验证进程
+        results = self.poll(block=True)
+        self.job_queue.put(None)
+        self.process.join()
+        return results
@@ -29,10 +29,160 @@ def generate(model, tokenizer, text, max_length, device):
     return "".join(decode)
 
 
+def greedy_generate_batch(model, input, max_length, sep_token, pad_token):
+    ##
+    # input: [batch_size, seq_len]，每一行的长度相同，不含 pad
+    ##
+    batch_size, input_len = input.size()
+    finished = torch.zeros(batch_size, dtype=torch.bool, device=input.device)
+    for _ in range(max_length + 1):
+        projected, self_attns = model(input)
+        # 取每一行最后一个位置的预测, [batch_size]
+        next_symbol = projected.view(batch_size, -1, projected.size(-1))[:, -1].argmax(dim=-1)
+        # 已经生成 <sep> 的行之后只补 pad
+        next_symbol = next_symbol.masked_fill(finished, pad_token)
+        input = torch.cat([input.detach(), next_symbol.unsqueeze(-1)], -1)
+        finished |= next_symbol.eq(sep_token)
+        if finished.all():
+            break
+    # 只返回新生成的部分, [batch_size, gen_len]
+    return input[:, input_len:]
+
+
+def filter_logits(logits, top_k=0, top_p=1.0):
+    ##
+    # logits: [batch_size, vocab_size]
+    ##
+    if top_k > 0:
+        # 只保留概率最大的 top_k 个词
+        kth = torch.topk(logits, min(top_k, logits.size(-1)), dim=-1)[0][:, -1:]
+        logits = logits.masked_fill(logits < kth, float('-inf'))
+    if top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, dim=-1, descending=True)
+        sorted_probs = torch.softmax(sorted_logits, dim=-1)
+        # 累计概率超过 top_p 之后的词去掉，概率最大的词一定保留
+        sorted_remove = sorted_probs.cumsum(dim=-1) - sorted_probs > top_p
+        remove = torch.zeros_like(sorted_remove).scatter(-1, sorted_idx, sorted_remove)
+        logits = logits.masked_fill(remove, float('-inf'))
+    return logits
+
+
+def sample_generate_batch(model, input, max_length, sep_token, pad_token,
+                          temperature=1.0, top_k=0, top_p=1.0, length_penalty=1.0):
+    ##
+    # input: [num_samples, seq_len]，每一行的长度相同，不含 pad
+    ##
+    if temperature <= 0:
+        raise Exception(f"temperature 必须大于 0：{temperature}")
+    batch_size, input_len = input.size()
+    finished = torch.zeros(batch_size, dtype=torch.bool, device=input.device)
+    # 每一行已生成序列的对数概率之和与长度
+    scores = torch.zeros(batch_size, device=input.device)
+    lengths = torch.zeros(batch_size, dtype=torch.long, device=input.device)
+    for _ in range(max_length + 1):
+        projected, self_attns = model(input)
+        logits = projected.view(batch_size, -1, projected.size(-1))[:, -1] / temperature
+        log_probs = torch.log_softmax(filter_logits(logits, top_k, top_p), dim=-1)
+        # 所有行一次采样, [batch_size]
+        next_symbol = torch.multinomial(log_probs.exp(), 1).squeeze(-1)
+        scores += log_probs.gather(-1, next_symbol.unsqueeze(-1)).squeeze(-1).masked_fill(finished, 0)
+        lengths += (~finished).long()
+        # 已经生成 <sep> 的行之后只补 pad
+        next_symbol = next_symbol.masked_fill(finished, pad_token)
+        input = torch.cat([input.detach(), next_symbol.unsqueeze(-1)], -1)
+        finished |= next_symbol.eq(sep_token)
+        if finished.all():
+            break
+    # 按长度惩罚后的分数从高到低排序
+    scores = scores / lengths.float() ** length_penalty
+    order = scores.argsort(descending=True)
+    return input[order, input_len:], scores[order]
+
+
+def beam_search_batch(model, input, max_length, sep_token, pad_token, beam_size=4, length_penalty=1.0):
+    ##
+    # input: [1, seq_len]，所有 beam 拼成一个 batch，每一步只做一次前向
+    ##
+    input_len = input.size(1)
+    input = input.repeat(beam_size, 1)
+    # 一开始所有 beam 相同，只从第一个 beam 扩展，避免选出重复的候选
+    scores = torch.full((beam_size,), float('-inf'), device=input.device)
+    scores[0] = 0
+    # 已结束（生成了 <sep>）的候选池：长度惩罚后的分数，以及用 pad 补齐的生成序列
+    finished_scores = torch.full((beam_size,), float('-inf'), device=input.device)
+    finished_seqs = torch.full((beam_size, 0), pad_token, dtype=torch.long, device=input.device)
+    for step in range(max_length + 1):
+        projected, self_attns = model(input)
+        vocab_size = projected.size(-1)
+        # [beam_size, vocab_size]
+        log_probs = torch.log_softmax(projected.view(beam_size, -1, vocab_size)[:, -1], dim=-1)
+        cand_scores = (scores.unsqueeze(-1) + log_probs).view(-1)
+        # 取 2 * beam_size 个候选，即使其中一半以 <sep> 结尾，也能填满活跃的 beam
+        top_scores, top_idx = cand_scores.topk(2 * beam_size)
+        beam_idx = torch.div(top_idx, vocab_size, rounding_mode='floor')
+        next_symbol = top_idx % vocab_size
+        # [2 * beam_size, seq_len + 1]
+        seqs = torch.cat([input[beam_idx], next_symbol.unsqueeze(-1)], -1)
+        is_sep = next_symbol.eq(sep_token)
+        # 活跃 beam 的生成长度都是 step + 1，以 <sep> 结尾的候选并入结束池
+        sep_scores = (top_scores / float(step + 1) ** length_penalty).masked_fill(~is_sep, float('-inf'))
+        finished_seqs = torch.cat([finished_seqs, torch.full((beam_size, 1), pad_token, dtype=torch.long, device=input.device)], -1)
+        pool_scores = torch.cat([finished_scores, sep_scores])
+        pool_seqs = torch.cat([finished_seqs, seqs[:, input_len:]])
+        finished_scores, pool_idx = pool_scores.topk(beam_size)
+        finished_seqs = pool_seqs[pool_idx]
+        # 活跃 beam 只从未结束的候选中选
+        scores, live_idx = top_scores.masked_fill(is_sep, float('-inf')).topk(beam_size)
+        input = seqs[live_idx]
+        # 最好的活跃 beam 已经比不过结束池中最差的候选，提前结束
+        if scores.max() / float(step + 1) ** length_penalty <= finished_scores.min():
+            break
+    # 结束池与活跃 beam 一起排序，活跃 beam 对应达到最大长度仍未结束的情况
+    gen_len = input.size(1) - input_len
+    all_scores = torch.cat([finished_scores, scores / float(gen_len) ** length_penalty])
+    all_seqs = torch.cat([finished_seqs, input[:, input_len:]])
+    all_scores, order = all_scores.topk(beam_size)
+    # 去掉没有有效候选的位置
+    valid = torch.isfinite(all_scores)
+    return all_seqs[order][valid], all_scores[valid]
+
+
+def generate_candidates(model, tokenizer, text, max_length, device, strategy="beam", num_candidates=4,
+                        length_penalty=1.0, temperature=1.0, top_k=0, top_p=1.0):
+    input, att_mask = tokenizer.encode(text)
+    input = torch.tensor(input, dtype=torch.long, device=device).unsqueeze(0)
+    with torch.no_grad():
+        if strategy == "beam":
+            generated, scores = beam_search_batch(model, input, max_length, tokenizer.sep_token,
+                                                  tokenizer.pad_token, num_candidates, length_penalty)
+        elif strategy == "sample":
+            generated, scores = sample_generate_batch(model, input.repeat(num_candidates, 1), max_length,
+                                                      tokenizer.sep_token, tokenizer.pad_token,
+                                                      temperature, top_k, top_p, length_penalty)
+        else:
+            raise Exception(f"不支持的解码方式：{strategy}")
+    # 截断到第一个 <sep>，按分数从高到低返回
+    candidates = []
+    for tokens in generated.tolist():
+        if tokenizer.sep_token in tokens:
+            tokens = tokens[:tokens.index(tokenizer.sep_token)]
+        candidates.append("".join(tokenizer.decode(tokens)))
+    return candidates
+
+
 def main():
     model_path = "output/best.pt"
     vocab_path = "data/vocab.json"  # 词表位置
     max_length = 128  # 最大长度
+    strategy = "greedy"  # 解码方式：greedy、beam、sample
+    # beam/sample 的解码参数
+    decode_param = {
+        "num_candidates": 4,  # beam 数量或采样的候选数量
+        "length_penalty": 1.0,  # 长度惩罚系数
+        "temperature": 1.0,  # 采样温度
+        "top_k": 0,  # top-k 采样，0 表示不限制
+        "top_p": 0.9,  # top-p 采样
+    }
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     # 加载分词器
     tokenizer = Tokenizer(vocab_path)
@@ -58,7 +208,10 @@ def main():
             continue
         if text == "q":
             break
-        res = generate(model, tokenizer, text, max_length, device)
+        if strategy == "greedy":
+            res = generate(model, tokenizer, text, max_length, device)
+        else:
+            res = generate_candidates(model, tokenizer, text, max_length, device, strategy, **decode_param)[0]
         print("AI: ", res)
 
 
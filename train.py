@@ -4,6 +4,7 @@ from torch.utils.tensorboard import SummaryWriter
 from tokenizer import Tokenizer
 from model import GPTModel
 from qa_dataset import QADataset
+from evaluate import validate_model, build_val_loader, AsyncValidator
 from tqdm import tqdm
 import time, sys, os
 
@@ -11,9 +12,11 @@ import time, sys, os
 训练小批量的数据集也就是train.jsonl
 """
 def train_model(model, train_loader, val_loader, optimizer, criterion,
-                device, num_epochs, model_output_dir, writer):
+                device, num_epochs, model_output_dir, writer, val_interval=1, validator=None):
     batch_step = 0
     best_val_loss = float('inf')
+    # 异步验证时，等待验证结果的各个 epoch 的权重副本
+    snapshots = {}
     for epoch in range(num_epochs):
         time1 = time.time()
         model.train()
@@ -35,34 +38,46 @@ def train_model(model, train_loader, val_loader, optimizer, criterion,
                 time2 = time.time()
                 tqdm.write(
                     f"{index}, epoch: {epoch} -loss: {str(loss)} ; lr: {optimizer.param_groups[0]['lr']} ;each step's time spent: {(str(float(time2 - time1) / float(index + 0.0001)))}")
-        # 验证
-        model.eval()
-        val_loss = validate_model(model, criterion, device, val_loader)
-        writer.add_scalar('Loss/val', val_loss, epoch)
-        print(f"val loss: {val_loss} , epoch: {epoch}")
-        # 保存最优模型
-        if val_loss < best_val_loss:
-            best_val_loss = val_loss
-            best_model_path = os.path.join(model_output_dir, "best.pt")
-            print("Save Best Model To ", best_model_path, ", epoch: ", epoch)
-            torch.save(model.state_dict(), best_model_path)
+        # 验证，每 val_interval 个 epoch 一次，最后一个 epoch 一定验证
+        if (epoch + 1) % val_interval == 0 or epoch == num_epochs - 1:
+            if validator is None:
+                model.eval()
+                val_loss = validate_model(model, criterion, device, val_loader)
+                best_val_loss = log_val_result(writer, {"epoch": epoch, "val_loss": val_loss},
+                                               best_val_loss, model.state_dict(), model_output_dir)
+            else:
+                # 拷贝一份 CPU 上的权重交给验证进程，训练继续进行
+                snapshots[epoch] = {k: v.detach().to("cpu", copy=True) for k, v in model.state_dict().items()}
+                validator.submit(epoch, snapshots[epoch])
+        if validator is not None:
+            for result in validator.poll():
+                best_val_loss = log_val_result(writer, result, best_val_loss,
+                                               snapshots.pop(result["epoch"]), model_output_dir)
         # 保存当前模型
         last_model_path = os.path.join(model_output_dir, "last.pt")
         print("Save Last Model To ", last_model_path, ", epoch: ", epoch)
         torch.save(model.state_dict(), last_model_path)
+    # 等待剩余的异步验证结果
+    if validator is not None:
+        for result in validator.close():
+            best_val_loss = log_val_result(writer, result, best_val_loss,
+                                           snapshots.pop(result["epoch"]), model_output_dir)
 
 
-def validate_model(model, criterion, device, val_loader):
-    running_loss = 0.0
-    with torch.no_grad():
-        for _, data in enumerate(tqdm(val_loader, file=sys.stdout, desc="Validation Data")):
-            input_ids = data['input_ids'].to(device, dtype=torch.long)
-            attention_mask = data['attention_mask'].to(device, dtype=torch.long)
-            labels = data['labels'].to(device, dtype=torch.long)
-            outputs, dec_self_attns = model(input_ids, attention_mask)
-            loss = criterion(outputs, labels.view(-1))
-            running_loss += loss.item()
-    return running_loss / len(val_loader)
+def log_val_result(writer, result, best_val_loss, state_dict, model_output_dir):
+    epoch, val_loss = result["epoch"], result["val_loss"]
+    writer.add_scalar('Loss/val', val_loss, epoch)
+    print(f"val loss: {val_loss} , epoch: {epoch}")
+    if result.get("exact_match") is not None:
+        writer.add_scalar('ExactMatch/val', result["exact_match"], epoch)
+        print(f"val exact match: {result['exact_match']} , epoch: {epoch}")
+    # 保存最优模型
+    if val_loss < best_val_loss:
+        best_val_loss = val_loss
+        best_model_path = os.path.join(model_output_dir, "best.pt")
+        print("Save Best Model To ", best_model_path, ", epoch: ", epoch)
+        torch.save(state_dict, best_model_path)
+    return best_val_loss
 
 
 def main():
@@ -75,6 +90,10 @@ def main():
     lr = 2e-4  # 学习率
     model_output_dir = "output"  # 模型保存目录
     logs_dir = "logs"  # 日志记录目标
+    val_interval = 1  # 每隔多少个 epoch 验证一次
+    val_subsample = 1.0  # 验证集采样比例
+    async_val = False  # 是否在独立进程中异步验证，训练不等待验证结果
+    gen_samples = 64  # 异步验证时用贪心生成计算完全匹配率的样本数，0 表示不计算
     # 设备
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     # 加载分词器
@@ -100,14 +119,26 @@ def main():
     }
     training_set = QADataset(train_json_path, tokenizer, max_length)
     training_loader = DataLoader(training_set, **train_params)
-    print("Start Load Validation Data...")
-    val_params = {
-        "batch_size": batch_size,
-        "shuffle": False,
-        "num_workers": 4,
-    }
-    val_set = QADataset(val_json_path, tokenizer, max_length)
-    val_loader = DataLoader(val_set, **val_params)
+    val_loader = None
+    validator = None
+    if async_val:
+        print("Start Validation Process...")
+        eval_param = {
+            "val_json_path": val_json_path,
+            "vocab_path": vocab_path,
+            "max_length": max_length,
+            "batch_size": batch_size,
+            "subsample": val_subsample,
+            "gen_samples": gen_samples,
+            "gen_max_length": max_length,
+            "model_param": model_param,
+            "device": device,  # 验证进程使用的设备
+        }
+        validator = AsyncValidator(eval_param)
+    else:
+        print("Start Load Validation Data...")
+        val_set = QADataset(val_json_path, tokenizer, max_length)
+        val_loader = build_val_loader(val_set, batch_size, val_subsample, num_workers=4)
     # 日志记录
     writer = SummaryWriter(logs_dir)
     # 优化器
@@ -126,7 +157,9 @@ def main():
         device=device,
         num_epochs=epochs,
         model_output_dir=model_output_dir,
-        writer=writer
+        writer=writer,
+        val_interval=val_interval,
+        validator=validator
     )
     writer.close()
 